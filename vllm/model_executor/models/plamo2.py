@@ -2,6 +2,7 @@
 # SPDX-FileCopyrightText: Copyright contributors to the vLLM project
 """Inference-only PLaMo2 model."""
 
+import re
 from collections.abc import Iterable
 from itertools import islice
 from typing import TYPE_CHECKING
@@ -131,6 +132,7 @@ class Plamo2MambaMixer(MambaBase, PluggableLayer):
         self.tp_size = get_tensor_model_parallel_world_size()
         self.head_dim = self.config.hidden_size_per_head
         self.num_heads = self.config.mamba_num_heads
+        self.num_heads_per_rank = divide(self.num_heads, self.tp_size)
         self.time_step_rank = max(64, self.hidden_size // 16)
         self.conv1d = ColumnParallelLinear(
             input_size=self.conv_kernel_size,
@@ -144,6 +146,10 @@ class Plamo2MambaMixer(MambaBase, PluggableLayer):
         # `ColumnParallelLinear` and `set_weight_attrs`
         # doesn't allow to override it
         self.conv1d.weight.data = self.conv1d.weight.data.unsqueeze(1)
+        conv_weights = self.conv1d.weight.view(
+            self.conv1d.weight.size(0), self.conv1d.weight.size(2)
+        )
+        self.register_buffer("conv_weights", conv_weights, persistent=False)
 
         self.in_proj = MergedColumnParallelLinear(
             self.hidden_size,
@@ -162,6 +168,12 @@ class Plamo2MambaMixer(MambaBase, PluggableLayer):
             prefix=f"{prefix}.bcdt_proj",
             return_bias=False,
         )
+        # Static views into the bcdt_proj output, laid out as [B, C, dt]
+        # along the last dim; computed once instead of re-splitting every
+        # forward.
+        self._B_slice = slice(0, self.ssm_state_size)
+        self._C_slice = slice(self.ssm_state_size, 2 * self.ssm_state_size)
+        self._dt_slice = slice(2 * self.ssm_state_size, None)
         # time step projection (discretization) -
         # In the forward we need to apply dt_proj without the bias,
         # as the bias is added in the selective scan kernel.
@@ -176,12 +188,12 @@ class Plamo2MambaMixer(MambaBase, PluggableLayer):
 
         self.A = nn.Parameter(
             torch.empty(
-                divide(self.num_heads, self.tp_size),
+                self.num_heads_per_rank,
                 dtype=torch.float32,
             )
         )
-        self.D = nn.Parameter(torch.ones(divide(self.num_heads, self.tp_size)))
-        self.dt_bias = nn.Parameter(torch.ones(divide(self.num_heads, self.tp_size)))
+        self.D = nn.Parameter(torch.ones(self.num_heads_per_rank))
+        self.dt_bias = nn.Parameter(torch.ones(self.num_heads_per_rank))
 
         set_weight_attrs(self.D, {"weight_loader": sharded_weight_loader(0)})
         a_weight_loader = composed_weight_loader(
@@ -190,6 +202,16 @@ class Plamo2MambaMixer(MambaBase, PluggableLayer):
         set_weight_attrs(self.A, {"weight_loader": a_weight_loader})
         set_weight_attrs(self.dt_bias, {"weight_loader": sharded_weight_loader(0)})
 
+        # The decode path feeds A/D/dt_bias to selective_state_update as
+        # static per-head broadcasts; build the expanded views once. Weight
+        # loaders update the parameter storage in place, so the views stay
+        # valid after checkpoint loading.
+        self.A_expanded = self.A[:, None, None].expand(
+            -1, self.head_dim, self.ssm_state_size
+        )
+        self.dt_bias_expanded = self.dt_bias[:, None].expand(-1, self.head_dim)
+        self.D_expanded = self.D[:, None].expand(-1, self.head_dim)
+
         self.out_proj = RowParallelLinear(
             self.intermediate_size,
             self.hidden_size,
@@ -216,6 +238,13 @@ class Plamo2MambaMixer(MambaBase, PluggableLayer):
         self.kv_cache = (torch.tensor([]), torch.tensor([]))
         assert self.chunk_size != -1, "chunk_size must be set for v1"
 
+        # Check if running on Blackwell (SM100+) for kernel tuning
+        self.is_blackwell = current_platform.is_device_capability_family(100)
+
+        # Computed lazily by get_state_shape; the inputs are all fixed at
+        # construction time.
+        self._state_shape: tuple[tuple[int, ...], tuple[int, ...]] | None = None
+
         self.prefix = prefix
 
     def _project_ssm_parameters(self, hidden_states):
@@ -224,16 +253,16 @@ class Plamo2MambaMixer(MambaBase, PluggableLayer):
             ssm_parameters = self.bcdt_proj(hidden_states.contiguous())
         else:
             ssm_parameters = self.bcdt_proj(hidden_states)
-        B, C, time_step = torch.split(
-            ssm_parameters,
-            [self.ssm_state_size, self.ssm_state_size, self.time_step_rank],
-            dim=-1,
-        )
-
-        # vllm._custom_ops.rms_norm requires contiguous input tensors.
-        time_step = self.dt_norm(time_step.contiguous())
-        B = self.B_norm(B.contiguous())
-        C = self.C_norm(C.contiguous())
+        B = ssm_parameters[..., self._B_slice]
+        C = ssm_parameters[..., self._C_slice]
+        time_step = ssm_parameters[..., self._dt_slice]
+
+        # The sliced views stay contiguous along the last dim, which is all
+        # the rms_norm kernels require; strided leading dims are handled
+        # in-kernel (the vllm_c wrapper reshapes for ROCm).
+        time_step = self.dt_norm(time_step)
+        B = self.B_norm(B)
+        C = self.C_norm(C)
         dt = self.dt_proj(time_step)
         return B, C, dt
 
@@ -290,11 +319,6 @@ class Plamo2MambaMixer(MambaBase, PluggableLayer):
         projected_states = self.in_proj(hidden_states)
         gate, hidden_states = projected_states.chunk(2, dim=-1)
 
-        # 2. Convolution sequence transformation
-        conv_weights = self.conv1d.weight.view(
-            self.conv1d.weight.size(0), self.conv1d.weight.size(2)
-        )
-
         if attn_metadata is None:
             # profile run
             hidden_states = (
@@ -325,7 +349,7 @@ class Plamo2MambaMixer(MambaBase, PluggableLayer):
         preallocated_ssm_out = torch.empty(
             [
                 num_prefill_tokens + num_decodes,
-                (self.num_heads // self.tp_size) * self.head_dim,
+                self.num_heads_per_rank * self.head_dim,
             ],
             dtype=hidden_states.dtype,
             device=hidden_states.device,
@@ -344,7 +368,7 @@ class Plamo2MambaMixer(MambaBase, PluggableLayer):
             x = hidden_states_p.transpose(0, 1)  # this is the form that causal-conv see
             hidden_states_p = causal_conv1d_fn(
                 x,
-                conv_weights,
+                self.conv_weights,
                 self.conv1d.bias,
                 activation=self.activation,
                 conv_states=conv_state,
@@ -374,7 +398,7 @@ class Plamo2MambaMixer(MambaBase, PluggableLayer):
 
             varlen_state = mamba_chunk_scan_combined_varlen(
                 hidden_states_p.view(
-                    num_prefill_tokens, self.num_heads // self.tp_size, self.head_dim
+                    num_prefill_tokens, self.num_heads_per_rank, self.head_dim
                 ),
                 dt,
                 self.A,
@@ -383,7 +407,7 @@ class Plamo2MambaMixer(MambaBase, PluggableLayer):
                 chunk_size=chunk_size,
                 D=self.D,
                 z=gate_p.view(
-                    num_prefill_tokens, self.num_heads // self.tp_size, self.head_dim
+                    num_prefill_tokens, self.num_heads_per_rank, self.head_dim
                 ),
                 dt_bias=self.dt_bias,
                 seq_idx=seq_idx_p,
@@ -407,7 +431,7 @@ class Plamo2MambaMixer(MambaBase, PluggableLayer):
             hidden_states_d = causal_conv1d_update(
                 hidden_states_d,
                 conv_state,
-                conv_weights,
+                self.conv_weights,
                 self.conv1d.bias,
                 self.activation,
                 conv_state_indices=state_indices_tensor_d,
@@ -423,16 +447,11 @@ class Plamo2MambaMixer(MambaBase, PluggableLayer):
             B, C, dt = self._project_ssm_parameters(hidden_states_d)
 
             # 3. State Space Model sequence transformation
-            A = self.A[:, None, ...][:, :, None].expand(
-                -1, self.head_dim, self.config.mamba_d_state
-            )
             dt = dt[:, :, None].expand(-1, -1, self.head_dim)
-            dt_bias = self.dt_bias[:, None, ...].expand(-1, self.head_dim)
-            D = self.D[:, None, ...].expand(-1, self.head_dim)
             B = B.unsqueeze(1)
             C = C.unsqueeze(1)
             hidden_states_d = hidden_states_d.view(
-                -1, self.num_heads // self.tp_size, self.head_dim
+                -1, self.num_heads_per_rank, self.head_dim
             )
 
             # - the hidden is reshaped into (bs, num_heads, head_dim)
@@ -444,15 +463,16 @@ class Plamo2MambaMixer(MambaBase, PluggableLayer):
                 ssm_state,
                 hidden_states_d,
                 dt,
-                A,
+                self.A_expanded,
                 B,
                 C,
-                D,
-                dt_bias,
+                self.D_expanded,
+                self.dt_bias_expanded,
                 z=gate_d.reshape(num_decodes, -1, self.head_dim),
                 dt_softplus=True,
                 state_batch_indices=state_indices_tensor_d,
                 out=preallocated_ssm_out_d.view(num_decodes, -1, self.head_dim),
+                is_blackwell=self.is_blackwell,
             )
 
         # 4. Final linear projection
@@ -468,15 +488,17 @@ class Plamo2MambaMixer(MambaBase, PluggableLayer):
         )
 
     def get_state_shape(self) -> tuple[tuple[int, ...], tuple[int, ...]]:
-        return MambaStateShapeCalculator.mamba2_state_shape(
-            intermediate_size=self.intermediate_size,
-            tp_world_size=get_tensor_model_parallel_world_size(),
-            n_groups=0,
-            num_heads=self.num_heads,
-            head_dim=self.head_dim,
-            state_size=self.ssm_state_size,
-            conv_kernel=self.conv_kernel_size,
-        )
+        if self._state_shape is None:
+            self._state_shape = MambaStateShapeCalculator.mamba2_state_shape(
+                intermediate_size=self.intermediate_size,
+                tp_world_size=self.tp_size,
+                n_groups=0,
+                num_heads=self.num_heads,
+                head_dim=self.head_dim,
+                state_size=self.ssm_state_size,
+                conv_kernel=self.conv_kernel_size,
+            )
+        return self._state_shape
 
     @property
     def mamba_type(self) -> MambaAttentionBackendEnum:
@@ -744,6 +766,40 @@ class Plamo2Decoder(torch.nn.Module):
         return hidden_states, residual
 
 
+# Checkpoint weight names that are incompatible with the vllm version of
+# the model. The keys are disjoint (no key matches inside another), so a
+# single regex pass is equivalent to applying the replacements in order.
+_WEIGHT_NAME_REPLACEMENTS = {
+    ".A_log": ".A",
+    ".B_norm_weight": ".B_norm.weight",
+    ".C_norm_weight": ".C_norm.weight",
+    ".dt_norm_weight": ".dt_norm.weight",
+    ".q_weight": ".q_norm.weight",
+    ".k_weight": ".k_norm.weight",
+}
+_WEIGHT_NAME_REPLACEMENTS_RE = re.compile(
+    "|".join(re.escape(key) for key in _WEIGHT_NAME_REPLACEMENTS)
+)
+
+# in_proj tensors whose gate/hidden halves need regrouping at load time.
+_MIXER_IN_PROJ_SUFFIXES = (
+    ".mixer.in_proj.weight",
+    ".mixer.in_proj.qweight",
+    ".mixer.in_proj.scales",
+    ".mixer.in_proj.qzeros",
+)
+
+# Offsets folded into the RMSNorm weights at load time, since vllm's
+# RMSNorm does not support an offset parameter. The final layernorm
+# ("norm.weight") additionally gets +1.0, matched exactly by name.
+_NORM_WEIGHT_OFFSETS = {
+    ".pre_mixer_norm": 1.0,
+    ".post_mixer_norm": 1.0 / 5,
+    ".pre_mlp_norm": 1.0,
+    ".post_mlp_norm": 5**-1.5,
+}
+
+
 @support_torch_compile
 class Plamo2Model(torch.nn.Module):
     def __init__(self, *, vllm_config: VllmConfig, prefix: str = ""):
@@ -800,40 +856,41 @@ class Plamo2Model(torch.nn.Module):
 
     def load_weights(self, weights: Iterable[tuple[str, torch.Tensor]]) -> set[str]:
         params_dict = dict(self.named_parameters())
+        # Resolve each parameter's loader once instead of a getattr per
+        # loaded weight.
+        weight_loaders = {
+            name: getattr(param, "weight_loader", default_weight_loader)
+            for name, param in params_dict.items()
+        }
         loaded_params: set[str] = set()
+        mamba_num_heads = self.config.mamba_num_heads
         for name, loaded_weight in weights:
             # Update the weight names to be compatible with the vllm version
             # of the model.
-            # Do not change the order of the replacements.
-            replacements = {
-                # Rename incompatible weight names.
-                ".A_log": ".A",
-                ".B_norm_weight": ".B_norm.weight",
-                ".C_norm_weight": ".C_norm.weight",
-                ".dt_norm_weight": ".dt_norm.weight",
-                ".q_weight": ".q_norm.weight",
-                ".k_weight": ".k_norm.weight",
-            }
-            # Apply replacements based on the defined mappings
-            for old, new in replacements.items():
-                if old in name:
-                    name = name.replace(old, new)
+            name = _WEIGHT_NAME_REPLACEMENTS_RE.sub(
+                lambda m: _WEIGHT_NAME_REPLACEMENTS[m.group(0)], name
+            )
+
+            # Skip layers on other devices before any of the reshaping
+            # below builds transient tensors for weights this rank discards.
+            if is_pp_missing_parameter(name, self):
+                continue
 
             # Reshape the in_proj weights to match the shape expected
-            # by MergedColumnParallelLinear.
+            # by MergedColumnParallelLinear. The checkpoint interleaves
+            # the gate and hidden halves per head along the output dim;
+            # MergedColumnParallelLinear expects all gate rows followed by
+            # all hidden rows, so this is a genuine permutation of the
+            # output dim and cannot be elided.
             # This works both for unquantized weights and
             # for quantized weights.
             # In the quantized case, the weights are already transposed.
             # Also, in addition to the quantized weights,
             # the zero points and scales have to be reshaped as well.
             # Packing should not be affected by this.
-            if (
-                ".mixer.in_proj.weight" in name
-                or "mixer.in_proj.qweight" in name
-                or "mixer.in_proj.scales" in name
-                or "mixer.in_proj.qzeros" in name
-            ):
-                if "mixer.in_proj.weight" in name:
+            if name.endswith(_MIXER_IN_PROJ_SUFFIXES):
+                is_unquantized_weight = name.endswith(".mixer.in_proj.weight")
+                if is_unquantized_weight:
                     loaded_weight = loaded_weight.transpose(0, 1)
                 # for weight:
                 # loaded_weight.shape[0] == self.config.hidden_size
@@ -841,37 +898,24 @@ class Plamo2Model(torch.nn.Module):
                 # loaded_weight.shape[0] == self.config.hidden_size // param.pack_factor  # noqa
                 # for scales and qzeros:
                 # loaded_weight.shape[0] == self.config.hidden_size // self.vllm_config.quant_config.group_size  # noqa
-                loaded_weight = loaded_weight.reshape(
-                    loaded_weight.shape[0], self.config.mamba_num_heads, -1
-                )
-                gate_weight, hidden_states_weight = loaded_weight.chunk(2, dim=-1)
-                gate_weight = gate_weight.reshape(loaded_weight.shape[0], -1)
-                hidden_states_weight = hidden_states_weight.reshape(
-                    loaded_weight.shape[0], -1
+                rows = loaded_weight.shape[0]
+                loaded_weight = (
+                    loaded_weight.reshape(rows, mamba_num_heads, 2, -1)
+                    .transpose(1, 2)
+                    .reshape(rows, -1)
                 )
-                loaded_weight = torch.cat([gate_weight, hidden_states_weight], dim=-1)
-                if "mixer.in_proj.weight" in name:
+                if is_unquantized_weight:
                     loaded_weight = loaded_weight.transpose(0, 1)
 
-            # Offset parameter with vllm's RMSNorm haven't been supported yet.
-            if ".pre_mixer_norm" in name:
-                loaded_weight += 1.0
-            elif ".post_mixer_norm" in name:
-                loaded_weight += 1.0 / 5
-            elif ".pre_mlp_norm" in name:
-                loaded_weight += 1.0
-            elif ".post_mlp_norm" in name:
-                loaded_weight += 1.0 / (5**1.5)
-            elif name == "norm.weight":
+            if name == "norm.weight":
                 loaded_weight += 1.0
+            else:
+                for suffix, offset in _NORM_WEIGHT_OFFSETS.items():
+                    if suffix in name:
+                        loaded_weight += offset
+                        break
 
-            # Skip layers on other devices.
-            if is_pp_missing_parameter(name, self):
-                continue
-
-            param = params_dict[name]
-            weight_loader = getattr(param, "weight_loader", default_weight_loader)
-            weight_loader(param, loaded_weight)
+            weight_loaders[name](params_dict[name], loaded_weight)
             loaded_params.add(name)
         return loaded_params
 